@@ -0,0 +1,178 @@
+"""
+Adaptive parameter sweeps over one or two fields of Parameters.
+
+The sweep starts from a coarse grid, and then repeatedly adds points where the summary of the simulations (by default
+the fraction of spindles that survive until par.max_time) changes the most between neighbouring points, or where it
+is most uncertain. Points in flat regions of the response (spindles always or never break) are not refined.
+
+Each replicate at a point is run with the seed given by seed_store.replicateSeed, so the results are reproducible and
+any replicate can be regenerated.
+"""
+import copy
+import numpy as np
+from simulation import Simulation
+from seed_store import parameterHash, replicateSeed
+
+
+def survived(sim):
+    """
+    Replicate summary: 1 if the spindle did not break before the end of the simulation, 0 otherwise
+    :param sim:
+    :type sim: Simulation
+    :return:
+    """
+    return 0. if sim.checkBrokenSpindle() else 1.
+
+
+def runReplicateSummary(par, replicate, replicate_summary):
+    """
+    Run a replicate and return its summary
+    :param par:
+    :param replicate: the replicate index
+    :param replicate_summary: a function that takes the simulation after running and returns a number
+    :return:
+    """
+    sim = Simulation(par, replicateSeed(parameterHash(par), replicate))
+    sim.run()
+    return replicate_summary(sim)
+
+
+def pointParameters(par, fields, point):
+    """
+    A copy of par where the fields are set to the values in point
+    :param par:
+    :param fields:
+    :param point:
+    :return:
+    """
+    point_par = copy.copy(par)
+    for field, value in zip(fields, point):
+        setattr(point_par, field, value)
+    return point_par
+
+
+def evaluatePoints(par, fields, points, nb_replicates, replicate_summary, n_jobs):
+    """
+    Run nb_replicates simulations at each point, all the replicates of all points are run in a single parallel batch
+    :return: a dictionary point -> (mean, standard error of the mean) of the replicate summaries
+    """
+    tasks = [(point, i) for point in points for i in range(nb_replicates)]
+    if n_jobs == 1:
+        values = [runReplicateSummary(pointParameters(par, fields, point), i, replicate_summary)
+                  for point, i in tasks]
+    else:
+        from joblib import Parallel, delayed
+        values = Parallel(n_jobs=n_jobs, verbose=1)(
+            delayed(runReplicateSummary)(pointParameters(par, fields, point), i, replicate_summary)
+            for point, i in tasks)
+
+    values = np.array(values).reshape(len(points), nb_replicates)
+    out = dict()
+    for point, point_values in zip(points, values):
+        out[point] = (np.mean(point_values), np.std(point_values) / np.sqrt(nb_replicates))
+    return out
+
+
+def refinementScore(*results):
+    """
+    How much an interval (or a cell) needs refinement: the change of the summary across its corners plus their
+    standard errors
+    :param results: (mean, standard error) at each corner
+    :return:
+    """
+    means = [r[0] for r in results]
+    errors = [r[1] for r in results]
+    return max(means) - min(means) + max(errors)
+
+
+def adaptiveSweep1D(par, field, low, high, nb_coarse=9, nb_replicates=100, max_points=60, min_step=0.,
+                    refine_per_round=4, replicate_summary=survived, n_jobs=1):
+    """
+    Adaptive sweep of a single field of Parameters
+    :param par: the parameters that are not swept
+    :type par: Parameters
+    :param field: the name of the swept field, e.g. 'v_growth'
+    :param low:
+    :param high:
+    :param nb_coarse: number of points of the initial grid
+    :param nb_replicates: simulations per point
+    :param max_points: the sweep stops when it reaches this number of points
+    :param min_step: intervals smaller than 2 * min_step are not refined
+    :param refine_per_round: number of intervals that are split in two at each round
+    :param replicate_summary: see runReplicateSummary
+    :param n_jobs: number of parallel jobs (requires joblib if larger than 1)
+    :return: arrays with the values of the field, the mean and the standard error of the summary, sorted by value
+    """
+    points = [(x,) for x in np.linspace(low, high, nb_coarse)]
+    results = evaluatePoints(par, [field], points, nb_replicates, replicate_summary, n_jobs)
+
+    while len(results) < max_points:
+        xs = sorted(results)
+        intervals = [(refinementScore(results[a], results[b]), a, b) for a, b in zip(xs[:-1], xs[1:])
+                     if b[0] - a[0] > 2 * min_step]
+        intervals = [interval for interval in intervals if interval[0] > 0]
+        if not intervals:
+            break
+        intervals.sort(reverse=True)
+        nb_new = min(refine_per_round, max_points - len(results))
+        new_points = [((a[0] + b[0]) / 2.,) for score, a, b in intervals[:nb_new]]
+        results.update(evaluatePoints(par, [field], new_points, nb_replicates, replicate_summary, n_jobs))
+
+    xs = sorted(results)
+    return (np.array([x[0] for x in xs]), np.array([results[x][0] for x in xs]),
+            np.array([results[x][1] for x in xs]))
+
+
+def adaptiveSweep2D(par, fields, bounds, nb_coarse=(5, 5), nb_replicates=100, max_points=200, min_step=(0., 0.),
+                    refine_per_round=4, replicate_summary=survived, n_jobs=1):
+    """
+    Adaptive sweep of two fields of Parameters. The plane is divided in rectangular cells, and at each round the cells
+    with highest refinementScore are split in four.
+    :param par: the parameters that are not swept
+    :type par: Parameters
+    :param fields: the names of the two swept fields, e.g. ['v_growth', 'alpha']
+    :param bounds: ((low_0, high_0), (low_1, high_1))
+    :param nb_coarse: number of points of the initial grid in each direction
+    :param min_step: cells smaller than 2 * min_step in either direction are not refined
+    :return: an array with a row per point (value_0, value_1, mean, standard error)
+    See adaptiveSweep1D for the rest of arguments.
+    """
+    x_grid = np.linspace(bounds[0][0], bounds[0][1], nb_coarse[0])
+    y_grid = np.linspace(bounds[1][0], bounds[1][1], nb_coarse[1])
+    points = [(x, y) for x in x_grid for y in y_grid]
+    results = evaluatePoints(par, fields, points, nb_replicates, replicate_summary, n_jobs)
+
+    # Each cell is represented by its lower left and upper right corners
+    cells = [(x_grid[i], y_grid[j], x_grid[i + 1], y_grid[j + 1])
+             for i in range(nb_coarse[0] - 1) for j in range(nb_coarse[1] - 1)]
+
+    while len(results) < max_points:
+        scored_cells = list()
+        for cell in cells:
+            x0, y0, x1, y1 = cell
+            if x1 - x0 <= 2 * min_step[0] or y1 - y0 <= 2 * min_step[1]:
+                continue
+            score = refinementScore(results[(x0, y0)], results[(x0, y1)], results[(x1, y0)], results[(x1, y1)])
+            if score > 0:
+                scored_cells.append((score, cell))
+        if not scored_cells:
+            break
+        scored_cells.sort(reverse=True)
+
+        # Split cells until the maximum number of points would be exceeded (each split adds up to 5 points)
+        new_points = set()
+        for score, cell in scored_cells[:refine_per_round]:
+            x0, y0, x1, y1 = cell
+            xm, ym = (x0 + x1) / 2., (y0 + y1) / 2.
+            cell_points = [(xm, ym), (xm, y0), (xm, y1), (x0, ym), (x1, ym)]
+            cell_points = [point for point in cell_points if point not in results]
+            if len(results) + len(new_points.union(cell_points)) > max_points:
+                break
+            new_points.update(cell_points)
+            cells.remove(cell)
+            cells += [(x0, y0, xm, ym), (xm, y0, x1, ym), (x0, ym, xm, y1), (xm, ym, x1, y1)]
+        if not new_points:
+            break
+        results.update(evaluatePoints(par, fields, sorted(new_points), nb_replicates, replicate_summary, n_jobs))
+
+    return np.array([[x, y, results[(x, y)][0], results[(x, y)][1]] for x, y in sorted(results)])
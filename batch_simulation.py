@@ -0,0 +1,360 @@
+"""
+Batched simulation: many replicates, each with its own parameters, are advanced together with numpy arrays.
+
+Each row of a BatchSimulation is a replicate with its own values of the fields in batch_fields, so a whole sweep grid
+can be packed in large batches (see runBatched) and the results routed back to their conditions. The model is the same
+as in Simulation (see simulation.py), with two differences:
+
+    * All the random numbers of the batch are drawn from a single generator, so a replicate can be reproduced only by
+      running the same batch with the same seed.
+    * Within a step of dt, rescue probabilities are computed before handling the microtubules lost during that step,
+      while Simulation handles microtubules sequentially. The difference vanishes as dt -> 0.
+
+The output of each row has the same format as the output of Simulation::run.
+"""
+import numpy as np
+from scipy.stats import beta as beta_distribution
+
+# Fields of Parameters that can be different in each row of the batch
+batch_fields = ['v_slide', 'v_growth', 'v_shrink', 'dt', 'max_time', 'midzone_mu', 'midzone_sigma', 'duration_r',
+                'duration_n', 'total_rescue', 'alpha', 'beta', 'ase1', 'rearrange_mts']
+
+# The lattice of microtubules, the same as in Simulation::__init__
+neighbour_list = [
+    [1, 3],  # top left
+    [0, 2, 4],  # top center
+    [1, 5],  # top right
+    [0, 4, 6],  # center left
+    [1, 3, 5, 7],  # center center
+    [2, 4, 8],  # center right
+    [3, 7],  # bottom left
+    [4, 6, 8],  # bottom center
+    [5, 7],  # bottom right
+]
+orientations = np.array([1, -1, 1, -1, 1, -1, 1, -1, 1])
+nb_mts = len(orientations)
+
+# adjacency[i, j] is 1 if grid positions i and j are neighbours
+adjacency = np.zeros([nb_mts, nb_mts])
+for i, neighbours in enumerate(neighbour_list):
+    adjacency[i, neighbours] = 1
+
+
+class BatchSimulation:
+
+    def __init__(self, pars, seed=None):
+        """
+        :param pars: a list of Parameters, one per row of the batch
+        :param seed: seed of the random number generator of the batch
+        """
+        self.rng = np.random.default_rng(seed)
+        self.nb_rows = len(pars)
+
+        # An array with a value per row for each of the batch_fields
+        for field in batch_fields:
+            dtype = bool if field in ['ase1', 'rearrange_mts'] else float
+            setattr(self, field, np.array([bool(getattr(par, field)) if dtype is bool else getattr(par, field)
+                                           for par in pars], dtype=dtype))
+
+        # The state of the simulation, arrays with a value per row or per row and microtubule id (as in Simulation and
+        # Microtubule)
+        self.t = np.zeros(self.nb_rows)
+        self.half_spindle_length = np.full(self.nb_rows, 2.)
+        self.midzone_edge = self.rng.normal(self.midzone_mu, self.midzone_sigma)
+        self.pos = np.tile(orientations * 1., (self.nb_rows, 1))
+        self.growing = np.ones([self.nb_rows, nb_mts], dtype=bool)
+        self.lost = np.zeros([self.nb_rows, nb_mts], dtype=bool)
+        self.grid_position = np.tile(np.arange(nb_mts), (self.nb_rows, 1))
+        self.step_grow = (self.dt * (self.v_growth - self.v_slide))[:, np.newaxis] * orientations
+        self.step_shrink = (-self.dt * (self.v_shrink + self.v_slide))[:, np.newaxis] * orientations
+        self.next_catastrophe = self.timeToNextCatastrophe(np.ones([self.nb_rows, nb_mts], dtype=bool)).reshape(
+            self.nb_rows, nb_mts)
+        self.prob_rescue = np.zeros([self.nb_rows, nb_mts])
+        self.rate_rescue = np.zeros([self.nb_rows, nb_mts])
+
+        # Whether each row is still running
+        self.active = np.ones(self.nb_rows, dtype=bool)
+
+        # The events, a list of tuples of arrays (row, mt_id, time, position, event_type, step), see logEvents
+        self.nb_steps = 0
+        self.events = list()
+        self.logEvents(np.ones([self.nb_rows, nb_mts], dtype=bool), -1)
+
+        self.updateProbRescue(np.arange(self.nb_rows))
+
+    def timeToNextCatastrophe(self, mask):
+        """
+        Sample the time to next catastrophe (see Simulation::timeToNextCatastrophe) for the microtubules in mask
+        :param mask: boolean array (nb_rows, nb_mts)
+        :return: array with the times of the microtubules in mask
+        """
+        rows = np.nonzero(mask)[0]
+        prob = self.rng.random(len(rows))
+        return -(np.log(1 - prob ** (1 / self.duration_n[rows])) / self.duration_r[rows])
+
+    def logEvents(self, mask, event_type):
+        """
+        Record an event for the microtubules in mask (see Simulation::run for the event types)
+        :param mask: boolean array (nb_rows, nb_mts)
+        :param event_type:
+        :return:
+        """
+        rows, mt_ids = np.nonzero(mask)
+        if len(rows):
+            self.events.append((rows, mt_ids, self.t[rows], self.pos[rows, mt_ids],
+                                np.full(len(rows), event_type), np.full(len(rows), self.nb_steps)))
+
+    def countNeighbours(self, rows):
+        """
+        Number of neighbours of each microtubule (see Microtubule::countNeighbours)
+        :param rows: indexes of rows
+        :return: array (len(rows), nb_mts)
+        """
+        occupied = np.zeros([len(rows), nb_mts])
+        row_idx, mt_ids = np.nonzero(np.logical_not(self.lost[rows]))
+        occupied[row_idx, self.grid_position[rows][row_idx, mt_ids]] = 1
+        neighbours_per_grid_position = occupied @ adjacency
+        return np.take_along_axis(neighbours_per_grid_position, self.grid_position[rows], axis=1)
+
+    def updateProbRescue(self, rows):
+        """
+        Update the probability and rate of rescue of wild-type rows (see Simulation::updateProbRescue)
+        :param rows: indexes of rows
+        :return:
+        """
+        rows = rows[np.logical_not(self.ase1[rows])]
+        if not len(rows):
+            return
+        linkers = np.where(self.lost[rows], 0, self.countNeighbours(rows))
+
+        # Each linker is counted twice since we iterate through all microtubules
+        total_linkers = linkers.sum(axis=1) / 2.
+
+        # Without linkers there are no rescues
+        rate_per_linker = np.zeros(len(rows))
+        idxs = total_linkers > 0
+        rate_per_linker[idxs] = (self.total_rescue[rows][idxs] / self.midzone_edge[rows][idxs] / 2. /
+                                 total_linkers[idxs])
+
+        self.rate_rescue[rows] = rate_per_linker[:, np.newaxis] * linkers
+        self.prob_rescue[rows] = 1 - np.exp(-self.rate_rescue[rows] * self.dt[rows, np.newaxis])
+
+    def updateProbRescueAse1(self, rows):
+        """
+        Update the probability of rescue of ase1 rows (see Simulation::updateProbRescueAse1)
+        :param rows: indexes of rows
+        :return:
+        """
+        rows = rows[self.ase1[rows]]
+        if not len(rows):
+            return
+        lengths = self.pos[rows] * orientations + self.half_spindle_length[rows, np.newaxis]
+        total_length = np.where(self.lost[rows], 0, lengths).sum(axis=1)
+        prob = np.zeros(len(rows))
+        idxs = total_length > 0
+        prob[idxs] = 1. - np.exp(-self.total_rescue[rows][idxs] / total_length[idxs] / 2. * self.dt[rows][idxs])
+        self.prob_rescue[rows] = prob[:, np.newaxis]
+
+    def swapMicrotubules(self, row, mt_1_id, mt_2_id):
+        grid = self.grid_position[row]
+        grid[mt_1_id], grid[mt_2_id] = grid[mt_2_id], grid[mt_1_id]
+
+    def performRearrangement(self, row, lost_mt_id):
+        """
+        Rearrange the microtubules of a row after a microtubule is lost, see Simulation::performRearrangement
+        :param row:
+        :param lost_mt_id:
+        :return:
+        """
+        neighbours = self.countNeighbours(np.array([row]))[0]
+        lost = self.lost[row]
+
+        # Case 1: other existing microtubules in the same orientation that have less neighbours
+        case1 = np.logical_and.reduce((
+            orientations == orientations[lost_mt_id],
+            np.arange(nb_mts) != lost_mt_id,
+            neighbours < neighbours[lost_mt_id],
+            np.logical_not(lost)
+        ))
+        if np.any(case1):
+            self.swapMicrotubules(row, lost_mt_id, self.rng.choice(np.flatnonzero(case1)))
+            return
+
+        # Case 2: A neighbour of the lost microtubule would have more neighbours if it was in another empty position
+        neighbours_of_lost_mt = np.logical_and(np.isin(self.grid_position[row], neighbour_list[lost_mt_id]),
+                                               np.logical_not(lost))
+        if not np.any(neighbours_of_lost_mt):
+            return
+        minimum_nb_neighbours = np.min(neighbours[neighbours_of_lost_mt])
+        microtubules_to_pick_from = np.logical_and(neighbours_of_lost_mt, neighbours == minimum_nb_neighbours)
+
+        case2 = np.logical_and.reduce((
+            orientations != orientations[lost_mt_id],
+            neighbours > minimum_nb_neighbours,
+            lost
+        ))
+        if np.any(case2):
+            neighbour_to_swap = self.rng.choice(np.flatnonzero(microtubules_to_pick_from))
+            empty_slot_to_swap = self.rng.choice(np.flatnonzero(case2))
+            self.swapMicrotubules(row, neighbour_to_swap, empty_slot_to_swap)
+
+    def checkBrokenSpindle(self, rows):
+        """
+        See Simulation::checkBrokenSpindle
+        :param rows: indexes of rows
+        :return: boolean array, True for rows where the spindle is broken
+        """
+        lengths = self.pos[rows] * orientations + self.half_spindle_length[rows, np.newaxis]
+        lengths[self.lost[rows]] = -np.inf
+        overlap = (lengths[:, orientations == 1].max(axis=1) + lengths[:, orientations == -1].max(axis=1) -
+                   self.half_spindle_length[rows] * 2)
+        return np.logical_not(overlap > 0)
+
+    def rescueProb(self, mask):
+        """
+        Probability of rescue of the microtubules in mask (see Microtubule::rescueProb), the ones that are lost should
+        not be in mask
+        :param mask: boolean array (nb_rows, nb_mts)
+        :return: array with the probabilities of the microtubules in mask
+        """
+        rows, mt_ids = np.nonzero(mask)
+        prob = np.zeros(len(rows))
+
+        # The constant probability of ase1 spindles
+        ase1 = self.ase1[rows]
+        prob[ase1] = self.prob_rescue[rows[ase1], mt_ids[ase1]]
+
+        # Wild-type microtubules inside the midzone
+        inside = np.logical_and(np.logical_not(ase1), np.abs(self.pos[rows, mt_ids]) < self.midzone_edge[rows])
+        uniform = np.logical_and(inside, self.alpha[rows] == 0)
+        prob[uniform] = self.prob_rescue[rows[uniform], mt_ids[uniform]]
+
+        with_beta = np.logical_and(inside, self.alpha[rows] != 0)
+        if np.any(with_beta):
+            r, m = rows[with_beta], mt_ids[with_beta]
+            x_beta = (self.pos[r, m] * orientations[m] + self.midzone_edge[r]) / (2 * self.midzone_edge[r])
+            rate = self.rate_rescue[r, m] * beta_distribution.pdf(x_beta, self.alpha[r], self.beta[r])
+            prob[with_beta] = 1. - np.exp(-rate * self.dt[r])
+
+        return prob
+
+    def step(self):
+        """
+        Advance all active rows by their dt (see Simulation::advance). Rows stop when they reach their max_time or
+        when their spindle breaks.
+        :return: False if all rows have stopped
+        """
+        self.active[self.t >= self.max_time] = False
+        rows = np.flatnonzero(self.active)
+        if not len(rows):
+            return False
+        self.nb_steps += 1
+
+        self.t[rows] += self.dt[rows]
+        self.half_spindle_length[rows] += self.dt[rows] * self.v_slide[rows]
+
+        broken = self.checkBrokenSpindle(rows)
+        self.active[rows[broken]] = False
+        rows = rows[np.logical_not(broken)]
+
+        self.updateProbRescueAse1(rows)
+
+        moving = np.zeros([self.nb_rows, nb_mts], dtype=bool)
+        moving[rows] = np.logical_not(self.lost[rows])
+        grow = np.logical_and(moving, self.growing)
+        shrink = np.logical_and(moving, np.logical_not(self.growing))
+        dt = np.broadcast_to(self.dt[:, np.newaxis], moving.shape)
+        half_spindle_length = self.half_spindle_length[:, np.newaxis]
+
+        # Growing microtubules, catastrophe also occurs if the microtubule hits the pole
+        self.pos[grow] += self.step_grow[grow]
+        self.next_catastrophe[grow] -= dt[grow]
+        catastrophe = np.logical_and(grow, np.logical_or(self.next_catastrophe < 0,
+                                                         self.pos * orientations > half_spindle_length))
+        self.growing[catastrophe] = False
+        self.logEvents(catastrophe, 0)
+
+        # Shrinking microtubules, which are lost if they depolymerise beyond the pole, or can be rescued
+        self.pos[shrink] += self.step_shrink[shrink]
+        lost = np.logical_and(shrink, self.pos * orientations < -half_spindle_length)
+        candidates = np.logical_and(shrink, np.logical_not(lost))
+        rescued = np.zeros_like(candidates)
+        rescued[candidates] = self.rng.random(np.count_nonzero(candidates)) < self.rescueProb(candidates)
+
+        self.growing[rescued] = True
+        self.next_catastrophe[rescued] = self.timeToNextCatastrophe(rescued)
+        self.logEvents(rescued, 1)
+
+        # Losses are rare, they are handled row by row
+        for row, mt_id in zip(*np.nonzero(lost)):
+            self.lost[row, mt_id] = True
+            if self.rearrange_mts[row] and not self.ase1[row]:
+                self.performRearrangement(row, mt_id)
+            self.updateProbRescue(np.array([row]))
+        self.logEvents(lost, 2)
+
+        return True
+
+    def run(self):
+        """
+        Run all rows until they stop
+        :return: a list with the output of each row, in the same format as Simulation::run
+        """
+        while self.step():
+            pass
+
+        # Write the final timepoint
+        self.nb_steps += 1
+        self.logEvents(np.logical_not(self.lost), 3)
+        return self.logs()
+
+    def logs(self):
+        """
+        :return: a list with the output of each row, in the same format as Simulation::run
+        """
+        rows, mt_ids, times, positions, event_types, steps = [np.concatenate(e) for e in zip(*self.events)]
+
+        # Within a row, events are sorted by step and then by microtubule id, like in Simulation
+        order = np.lexsort((mt_ids, steps, rows))
+        boundaries = np.searchsorted(rows[order], np.arange(self.nb_rows + 1))
+
+        out = list()
+        for row in range(self.nb_rows):
+            idxs = order[boundaries[row]:boundaries[row + 1]]
+            out.append(''.join(['%u %.2f %.2f %i %i\n' % (mt_id, t, pos, event_type, orientations[mt_id])
+                                for mt_id, t, pos, event_type in zip(mt_ids[idxs], times[idxs], positions[idxs],
+                                                                     event_types[idxs])]))
+        return out
+
+
+def runBatch(pars, seed):
+    return BatchSimulation(pars, seed).run()
+
+
+def runBatched(conditions, nb_replicates, batch_size=1000, seed=None, n_jobs=1):
+    """
+    Run nb_replicates of each condition, packing the replicates of all conditions in batches of batch_size rows
+    :param conditions: a list of Parameters
+    :param nb_replicates:
+    :param batch_size:
+    :param seed: seed from which the seeds of the batches are derived
+    :param n_jobs: number of batches run in parallel (requires joblib if larger than 1)
+    :return: a list with a list of outputs (see Simulation::run) per condition
+    """
+    rows = [(c, i) for c in range(len(conditions)) for i in range(nb_replicates)]
+    batches = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    tasks = [([conditions[c] for c, i in batch], batch_seed) for batch, batch_seed in zip(batches, seeds)]
+    if n_jobs == 1:
+        outputs = [runBatch(pars, batch_seed) for pars, batch_seed in tasks]
+    else:
+        from joblib import Parallel, delayed
+        outputs = Parallel(n_jobs=n_jobs, verbose=1)(delayed(runBatch)(pars, batch_seed) for pars, batch_seed in tasks)
+
+    # Route the outputs back to their conditions
+    results = [[None] * nb_replicates for _ in conditions]
+    for batch, batch_outputs in zip(batches, outputs):
+        for (c, i), output in zip(batch, batch_outputs):
+            results[c][i] = output
+    return results
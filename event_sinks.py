@@ -0,0 +1,94 @@
+"""
+Sinks receive the lines of the simulation output (see Simulation::run for the format) while the simulation runs.
+
+    StringSink: keeps all the output in memory, Simulation::run returns it as a string (default)
+    FileSink: writes the output to a file in chunks of lines
+    CallbackSink: passes the output in chunks of lines to a function
+    NullSink: discards the output
+
+With FileSink and CallbackSink the memory used does not grow with the simulated time.
+"""
+
+
+class StringSink:
+
+    def __init__(self):
+        self.lines = list()
+
+    def write(self, line):
+        self.lines.append(line)
+
+    def close(self):
+        """
+        Called at the end of Simulation::run, the return value is returned by Simulation::run
+        :return: the whole output as a string
+        """
+        return ''.join(self.lines)
+
+
+class NullSink:
+
+    def write(self, line):
+        pass
+
+    def close(self):
+        return ''
+
+
+class ChunkedSink:
+    """
+    Sink that passes the output to write_chunk every chunk_size lines, FileSink and CallbackSink are configurations of it
+    """
+
+    def __init__(self, write_chunk, chunk_size=10000):
+        """
+        :param write_chunk: function called with a string containing chunk_size lines of output
+        :param chunk_size:
+        """
+        self.write_chunk = write_chunk
+        self.chunk_size = chunk_size
+        self.buffer = list()
+
+    def write(self, line):
+        self.buffer.append(line)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write_chunk(''.join(self.buffer))
+            self.buffer = list()
+
+    def close(self):
+        self.flush()
+        return None
+
+
+class FileSink(ChunkedSink):
+
+    def __init__(self, path, chunk_size=10000):
+        """
+        :param path: the output file, it is overwritten if it exists
+        :param chunk_size:
+        """
+        self.path = path
+        self.file = open(path, 'w')
+        ChunkedSink.__init__(self, self.file.write, chunk_size)
+
+    def close(self):
+        """
+        :return: the path of the output file
+        """
+        ChunkedSink.close(self)
+        self.file.close()
+        return self.path
+
+
+class CallbackSink(ChunkedSink):
+
+    def __init__(self, callback, chunk_size=10000):
+        """
+        :param callback: function called with a string containing chunk_size lines of output
+        :param chunk_size:
+        """
+        ChunkedSink.__init__(self, callback, chunk_size)
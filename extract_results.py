@@ -1,9 +1,43 @@
 import os
+import sys
+import json
+import hashlib
 import numpy as np
 from scipy.interpolate import interp1d
+from reducers import Histogram, QuantileSketch, Reservoir, GridMoments
 
 v_sliding = 0.35
 
+# The times at which the polymer length and the number of microtubules are computed
+time_total_length = np.linspace(0, 20)
+half_spindle_length = 2 + time_total_length * v_sliding
+
+# If True, the replicates of each condition are summarised with streaming reducers (see StreamingSummary), which use
+# constant memory, instead of keeping all positions and padded per-replicate arrays
+streaming = False
+
+# Settings of the streaming summary: bins of the histograms of positions and loss times, quantiles of the positions
+# and size of the random sample of positions that is kept (0 to disable it)
+position_edges = np.linspace(-10, 10, 201)
+time_edges = np.linspace(0, 20, 201)
+quantiles = np.linspace(0, 1, 101)
+reservoir_size = 10000
+
+# If True, a manifest of the processed replicates is kept in the summary folder of each condition, with the values
+# extracted from each replicate cached in summary/cache. Only new or changed replicates are read again, and conditions
+# where nothing changed are skipped (see cachedReplicates)
+incremental = False
+
+# If True, replicates are identified by a hash of their content, otherwise by their size and modification time
+use_content_hash = False
+
+# Version of the values extracted by readReplicate, increase it when they change so that cached replicates are read
+# again (see analysisSettings)
+replicate_version = 2
+
+# Number of conditions processed in parallel (requires joblib if larger than 1)
+n_jobs = 1
+
 def padcat(lis):
     """
     Concatenate lists into a single numpy array, filling the holes with nans
@@ -20,64 +54,290 @@ def padcat(lis):
     return out
 
 
-for main_dir in ['runs_ase1_random']:
-
-    # For each condition
-    folders = os.listdir(main_dir)
-    folders.sort()
-    condition_dirs = [os.path.join(main_dir,i) for i in folders if os.path.isdir(os.path.join(main_dir,i)) and i[0] != '.']
-
-    for condition_dir in condition_dirs:
-        print(condition_dir)
-        rescue_positions = list()
-        catastrophe_positions = list()
-        nb_mts_all = list()
-        time_loss_all = list()
-        time_total_length = np.linspace(0, 20)
-        total_length_all = list()
-        half_spindle_length = 2 + time_total_length * v_sliding
-        simulations = [os.path.join(condition_dir,i) for i in os.listdir(condition_dir) if i.endswith('.csv')]
-
-        for sim in simulations:
-            data = np.genfromtxt(sim,delimiter=' ')
-
-            mt_ids = data[:, 0]
-            sim_time = data[:, 1]
-            sim_pos = data[:, 2]
-            event_type = data[:, 3]
-            orientation = data[:, 4]
-            sim_pos = sim_pos * orientation
-
-            time_loss = np.append(0, sim_time[event_type == 2])
-            nb_mts0 = len(np.unique(mt_ids))
-            nb_mts = np.arange(nb_mts0, nb_mts0 - len(time_loss), -1)
-            nb_mts_all.append(nb_mts)
-            time_loss_all.append(time_loss)
-            rescue_positions += list(sim_pos[event_type == 1])
-            catastrophe_positions += list(sim_pos[event_type == 0])
-
-            total_length = np.zeros_like(time_total_length)
-            for i in np.unique(mt_ids):
-                y = sim_pos[mt_ids == i]
-                t = sim_time[mt_ids == i]
-                interpolator = interp1d(t, y, bounds_error=False, fill_value=np.nan)
-                # nans is when the mt is gone
-                mt_length = interpolator(time_total_length) + half_spindle_length
-                idxs = np.logical_not(np.isnan(mt_length))
-                total_length[idxs] += mt_length[idxs]
-
-            total_length_all.append(total_length)
-
-        summary_dir = os.path.join(condition_dir, 'summary')
-        os.makedirs(summary_dir, exist_ok=True)
-        np.savetxt(os.path.join(summary_dir,'rescue_positions.csv'),rescue_positions)
-        np.savetxt(os.path.join(summary_dir, 'catastrophe_positions.csv'), catastrophe_positions)
-        np.savetxt(os.path.join(summary_dir, 'number_microtubules.csv'), padcat(nb_mts_all))
-        np.savetxt(os.path.join(summary_dir, 'microtubule_loss_time.csv'), padcat(time_loss_all))
+def readReplicate(sim):
+    """
+    Read the output of a simulation (see Simulation::run) and extract the values that are summarised for each condition
+    :param sim: path to the csv file
+    :return: a dictionary with the positions of rescues and catastrophes, the number of microtubules after each loss,
+    the times of loss, the total polymer length at the times in time_total_length (zero after the end of the
+    simulation), and the total polymer length and the number of microtubules at the times in time_total_length with nan
+    after the end of the simulation (used by StreamingSummary, so that only replicates that are still running are
+    averaged at each time)
+    """
+    data = np.genfromtxt(sim,delimiter=' ')
+
+    mt_ids = data[:, 0]
+    sim_time = data[:, 1]
+    sim_pos = data[:, 2]
+    event_type = data[:, 3]
+    orientation = data[:, 4]
+    sim_pos = sim_pos * orientation
+
+    time_loss = np.append(0, sim_time[event_type == 2])
+    nb_mts0 = len(np.unique(mt_ids))
+    nb_mts = np.arange(nb_mts0, nb_mts0 - len(time_loss), -1)
+
+    total_length = np.zeros_like(time_total_length)
+    for i in np.unique(mt_ids):
+        y = sim_pos[mt_ids == i]
+        t = sim_time[mt_ids == i]
+        interpolator = interp1d(t, y, bounds_error=False, fill_value=np.nan)
+        # nans is when the mt is gone
+        mt_length = interpolator(time_total_length) + half_spindle_length
+        idxs = np.logical_not(np.isnan(mt_length))
+        total_length[idxs] += mt_length[idxs]
+
+    # Number of microtubules at each time of time_total_length (losses are at time_loss[1:])
+    nb_mts_time = (nb_mts0 - np.searchsorted(time_loss[1:], time_total_length, side='right')).astype(float)
+
+    # After the end of the simulation (event 3, see Simulation::run) the values are unknown. If all microtubules were
+    # lost there is no end event, and both values stay at zero, since nothing can change after that
+    total_length_running = total_length.copy()
+    if np.any(event_type == 3):
+        after_end = time_total_length > sim_time[event_type == 3].max()
+        total_length_running[after_end] = np.nan
+        nb_mts_time[after_end] = np.nan
+
+    return {
+        'rescue_positions': sim_pos[event_type == 1],
+        'catastrophe_positions': sim_pos[event_type == 0],
+        'nb_mts': nb_mts,
+        'time_loss': time_loss,
+        'total_length': total_length,
+        'total_length_running': total_length_running,
+        'nb_mts_time': nb_mts_time,
+    }
+
+
+class StreamingSummary:
+    """
+    Summary of the replicates of a condition with streaming reducers (see reducers.py), the memory used does not
+    depend on the number of replicates. Summaries computed by different workers can be combined with merge.
+    """
+
+    def __init__(self, seed=None):
+        self.rescue_histogram = Histogram(position_edges)
+        self.catastrophe_histogram = Histogram(position_edges)
+        self.loss_time_histogram = Histogram(time_edges)
+        self.rescue_sketch = QuantileSketch()
+        self.catastrophe_sketch = QuantileSketch()
+        self.rescue_reservoir = Reservoir(reservoir_size, seed)
+        self.catastrophe_reservoir = Reservoir(reservoir_size, seed)
+        self.polymer_length = GridMoments(len(time_total_length))
+        self.number_microtubules = GridMoments(len(time_total_length))
+
+    def add(self, replicate):
+        """
+        :param replicate: the output of readReplicate
+        """
+        self.rescue_histogram.add(replicate['rescue_positions'])
+        self.catastrophe_histogram.add(replicate['catastrophe_positions'])
+        self.loss_time_histogram.add(replicate['time_loss'][1:])
+        self.rescue_sketch.add(replicate['rescue_positions'])
+        self.catastrophe_sketch.add(replicate['catastrophe_positions'])
+        self.rescue_reservoir.add(replicate['rescue_positions'])
+        self.catastrophe_reservoir.add(replicate['catastrophe_positions'])
+        self.polymer_length.add(replicate['total_length_running'])
+        self.number_microtubules.add(replicate['nb_mts_time'])
+
+    def merge(self, other):
+        """
+        :type other: StreamingSummary
+        """
+        for name, reducer in self.__dict__.items():
+            reducer.merge(getattr(other, name))
+
+    def save(self, summary_dir):
+        np.savetxt(os.path.join(summary_dir, 'rescue_positions_histogram.csv'), self.rescue_histogram.toArray())
+        np.savetxt(os.path.join(summary_dir, 'catastrophe_positions_histogram.csv'),
+                   self.catastrophe_histogram.toArray())
+        np.savetxt(os.path.join(summary_dir, 'microtubule_loss_time_histogram.csv'),
+                   self.loss_time_histogram.toArray())
+        np.savetxt(os.path.join(summary_dir, 'rescue_positions_quantiles.csv'), self.rescue_sketch.toArray(quantiles))
+        np.savetxt(os.path.join(summary_dir, 'catastrophe_positions_quantiles.csv'),
+                   self.catastrophe_sketch.toArray(quantiles))
+        if reservoir_size:
+            np.savetxt(os.path.join(summary_dir, 'rescue_positions_sample.csv'), self.rescue_reservoir.sample)
+            np.savetxt(os.path.join(summary_dir, 'catastrophe_positions_sample.csv'), self.catastrophe_reservoir.sample)
+        np.savetxt(os.path.join(summary_dir, 'polymer_length_moments.csv'), self.polymer_length.toArray())
+        np.savetxt(os.path.join(summary_dir, 'number_microtubules_moments.csv'), self.number_microtubules.toArray())
         np.savetxt(os.path.join(summary_dir, 'spindle_length.csv'), half_spindle_length*2)
-        np.savetxt(os.path.join(summary_dir, 'polymer_length.csv'), padcat(total_length_all))
 
 
+def fileIdentity(path):
+    """
+    Values that change when a replicate file changes (see use_content_hash)
+    :param path:
+    :return:
+    """
+    stat = os.stat(path)
+    identity = {'size': stat.st_size}
+    if use_content_hash:
+        with open(path, 'rb') as ins:
+            identity['sha1'] = hashlib.sha1(ins.read()).hexdigest()
+    else:
+        identity['mtime_ns'] = stat.st_mtime_ns
+    return identity
+
+
+def analysisSettings():
+    """
+    Settings that change the values extracted from the replicates or the summary files, if they change all replicates
+    are read again
+    :return:
+    """
+    return {
+        'replicate_version': replicate_version,
+        'v_sliding': v_sliding,
+        'time_total_length': time_total_length.tolist(),
+        'half_spindle_length': half_spindle_length.tolist(),
+        'streaming': streaming,
+        'position_edges': position_edges.tolist(),
+        'time_edges': time_edges.tolist(),
+        'quantiles': quantiles.tolist(),
+        'reservoir_size': reservoir_size,
+    }
+
+
+def cachedReplicates(summary_dir, simulations, manifest, new_manifest):
+    """
+    Generator of the output of readReplicate for each simulation, where unchanged replicates are read from the cache.
+    :param summary_dir:
+    :param simulations: paths of the csv files
+    :param manifest: the previous manifest of the condition
+    :param new_manifest: the replicates are added to it as they are read, it is written with writeManifest once the
+    summary files are saved, so that an interrupted analysis is repeated
+    :return:
+    """
+    cache_dir = os.path.join(summary_dir, 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+
+    for sim in simulations:
+        name = os.path.basename(sim)
+        identity = fileIdentity(sim)
+        cache_file = os.path.join(cache_dir, name[:-len('.csv')] + '.npz')
+        if manifest['replicates'].get(name) == identity and os.path.isfile(cache_file):
+            with np.load(cache_file) as cached:
+                replicate = dict(cached)
+        else:
+            replicate = readReplicate(sim)
+            np.savez(cache_file, **replicate)
+        new_manifest['replicates'][name] = identity
+        yield replicate
+
+    # Remove the cache of replicates that no longer exist
+    for name in manifest['replicates']:
+        if name not in new_manifest['replicates']:
+            cache_file = os.path.join(cache_dir, name[:-len('.csv')] + '.npz')
+            if os.path.isfile(cache_file):
+                os.remove(cache_file)
+
+
+def readManifest(summary_dir):
+    """
+    Read the manifest of a condition, if it does not exist or the settings changed, an empty manifest is returned
+    :param summary_dir:
+    :return:
+    """
+    manifest = {'settings': analysisSettings(), 'replicates': dict()}
+    manifest_file = os.path.join(summary_dir, 'manifest.json')
+    if os.path.isfile(manifest_file):
+        with open(manifest_file) as ins:
+            stored = json.load(ins)
+        if stored['settings'] == manifest['settings']:
+            manifest = stored
+    return manifest
+
+
+def writeManifest(summary_dir, manifest):
+    with open(os.path.join(summary_dir, 'manifest.json'), 'w') as out:
+        json.dump(manifest, out, indent=1, sort_keys=True)
+
+
+def saveReplicates(summary_dir, replicates):
+    """
+    Write all rescue and catastrophe positions, and the per-replicate arrays padded with nans
+    :param summary_dir:
+    :param replicates: the outputs of readReplicate
+    :return:
+    """
+    rescue_positions = list()
+    catastrophe_positions = list()
+    nb_mts_all = list()
+    time_loss_all = list()
+    total_length_all = list()
+
+    for replicate in replicates:
+        nb_mts_all.append(replicate['nb_mts'])
+        time_loss_all.append(replicate['time_loss'])
+        rescue_positions += list(replicate['rescue_positions'])
+        catastrophe_positions += list(replicate['catastrophe_positions'])
+        total_length_all.append(replicate['total_length'])
+
+    np.savetxt(os.path.join(summary_dir,'rescue_positions.csv'),rescue_positions)
+    np.savetxt(os.path.join(summary_dir, 'catastrophe_positions.csv'), catastrophe_positions)
+    np.savetxt(os.path.join(summary_dir, 'number_microtubules.csv'), padcat(nb_mts_all))
+    np.savetxt(os.path.join(summary_dir, 'microtubule_loss_time.csv'), padcat(time_loss_all))
+    np.savetxt(os.path.join(summary_dir, 'spindle_length.csv'), half_spindle_length*2)
+    np.savetxt(os.path.join(summary_dir, 'polymer_length.csv'), padcat(total_length_all))
+
+
+
+def summarizeCondition(condition_dir):
+    """
+    Read all the replicates of a condition and write the summary files in condition_dir/summary
+    :param condition_dir:
+    :return:
+    """
+    print(condition_dir)
+    simulations = [os.path.join(condition_dir,i) for i in os.listdir(condition_dir) if i.endswith('.csv')]
+    simulations.sort()
+    if not simulations:
+        # Conditions stored with seed_store.runSeedOnly only have their seeds, see seed_store.readEvents
+        print('    no result files, skipped')
+        return
+
+    summary_dir = os.path.join(condition_dir, 'summary')
+    os.makedirs(summary_dir, exist_ok=True)
+
+    if incremental:
+        manifest = readManifest(summary_dir)
+        current = dict((os.path.basename(sim), fileIdentity(sim)) for sim in simulations)
+        if current == manifest['replicates']:
+            print('    up to date')
+            return
+        new_manifest = {'settings': analysisSettings(), 'replicates': dict()}
+        replicates = cachedReplicates(summary_dir, simulations, manifest, new_manifest)
+    else:
+        replicates = (readReplicate(sim) for sim in simulations)
+
+    if streaming:
+        summary = StreamingSummary()
+        for replicate in replicates:
+            summary.add(replicate)
+        summary.save(summary_dir)
+    else:
+        saveReplicates(summary_dir, replicates)
+
+    if incremental:
+        writeManifest(summary_dir, new_manifest)
+
+
+if __name__ == '__main__':
+    # The directories to analyse can be given as arguments
+    main_dirs = sys.argv[1:] if len(sys.argv) > 1 else ['runs_ase1_random']
 
+    for main_dir in main_dirs:
 
+        # For each condition
+        folders = os.listdir(main_dir)
+        folders.sort()
+        condition_dirs = [os.path.join(main_dir,i) for i in folders if os.path.isdir(os.path.join(main_dir,i)) and i[0] != '.']
 
+        if n_jobs == 1:
+            for condition_dir in condition_dirs:
+                summarizeCondition(condition_dir)
+        else:
+            from joblib import Parallel, delayed
+            Parallel(n_jobs=n_jobs, verbose=1)(delayed(summarizeCondition)(condition_dir)
+                                               for condition_dir in condition_dirs)
@@ -0,0 +1,137 @@
+"""
+Plot all the replicates of a condition in a single figure, with the same styling as plot_simulation2.py.
+
+    plotEnsembleLines: all microtubule trajectories are drawn as a single LineCollection
+    plotEnsembleDensity: the positions of microtubule plus ends are binned in (time, position) and drawn as an image
+
+Example:
+
+    import glob
+    import matplotlib.pyplot as plt
+    files = sorted(glob.glob('runs_ase1/runs_34.0/result_*.csv'))
+    fig, ax = plt.subplots()
+    plotEnsembleDensity(ax, files)
+    plotPoles(ax)
+    plt.savefig('ensemble.svg')
+"""
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgb
+from seed_store import readEvents
+
+# Colors of microtubules indexed by orientation (1 or -1), and of the spindle poles
+colors = ['#dd7eae','#dd7eae','#0076b9']
+pole_color = '#5e5e5eff'
+
+
+def trajectorySegments(files):
+    """
+    The trajectories of all microtubules in the files. Since microtubules grow and shrink at constant speed between
+    events, each trajectory is the polyline joining its events.
+    :param files: paths of result_XX.csv files, they are regenerated if only their seed was stored (see seed_store.py)
+    :return: a list of arrays (nb_events, 2) with the time and the position of the plus end (with the sign used in
+    plot_simulation2.py), and an array with the orientation of each trajectory
+    """
+    segments = list()
+    orientations = list()
+    for f in files:
+        data = readEvents(f)
+        mt_ids = data[:, 0]
+        sim_time = data[:, 1]
+        sim_pos = data[:, 2]
+        orientation = data[:, 4]
+        for i in np.unique(mt_ids):
+            logi = mt_ids == i
+            segments.append(np.column_stack((sim_time[logi], -sim_pos[logi])))
+            orientations.append(orientation[logi][0])
+    return segments, np.array(orientations)
+
+
+def plotPoles(ax, v_slide=0.35, max_time=20.):
+    """
+    Plot the position of the spindle poles
+    :param ax:
+    :param v_slide:
+    :param max_time:
+    :return:
+    """
+    t = np.linspace(0, max_time)
+    ax.plot(t, 2 + t * v_slide, c=pole_color, lw=3)
+    ax.plot(t, -2 - t * v_slide, c=pole_color, lw=3)
+
+
+def plotEnsembleLines(ax, files, alpha=0.2, lw=0.5, rasterized=False):
+    """
+    Plot the trajectories of all microtubules in the files as a single LineCollection
+    :param ax:
+    :param files: see trajectorySegments
+    :param alpha:
+    :param lw:
+    :param rasterized: draw the lines as an image in vector formats (svg, pdf), to keep the files small
+    :return: the LineCollection
+    """
+    segments, orientations = trajectorySegments(files)
+    lines = LineCollection(segments, colors=[colors[int(o)] for o in orientations], alpha=alpha, lw=lw,
+                           rasterized=rasterized)
+    ax.add_collection(lines)
+    ax.autoscale_view()
+    return lines
+
+
+def trajectoryDensity(segments, orientations, time_edges, position_edges, orientation=None):
+    """
+    Count the positions of plus ends in bins of (time, position). Each trajectory is sampled at the centers of the time
+    bins where the microtubule exists.
+    :param segments: the trajectories, see trajectorySegments
+    :param orientations: the orientation of each trajectory, see trajectorySegments
+    :param time_edges:
+    :param position_edges:
+    :param orientation: if 1 or -1, only microtubules with this orientation are counted
+    :return: array (len(time_edges) - 1, len(position_edges) - 1) with the counts
+    """
+    time_centers = (time_edges[:-1] + time_edges[1:]) / 2.
+
+    times = list()
+    positions = list()
+    for segment, o in zip(segments, orientations):
+        if orientation is not None and o != orientation:
+            continue
+        first, last = np.searchsorted(time_centers, [segment[0, 0], segment[-1, 0]], side='left')
+        t = time_centers[first:last]
+        times.append(t)
+        positions.append(np.interp(t, segment[:, 0], segment[:, 1]))
+
+    if not times:
+        return np.zeros([len(time_edges) - 1, len(position_edges) - 1])
+    return np.histogram2d(np.concatenate(times), np.concatenate(positions), [time_edges, position_edges])[0]
+
+
+def plotEnsembleDensity(ax, files, time_edges=np.linspace(0, 20, 201), position_edges=np.linspace(-10, 10, 201),
+                        orientation=None, cmap=None):
+    """
+    Plot the density of plus ends in (time, position) as a rasterized image. If orientation is None, microtubules of
+    each orientation are drawn in their color (see colors), with the intensity proportional to their density.
+    :param ax:
+    :param files: see trajectorySegments
+    :param time_edges:
+    :param position_edges:
+    :param orientation: see trajectoryDensity
+    :param cmap: colormap used if orientation is given
+    :return: the image
+    """
+    extent = [time_edges[0], time_edges[-1], position_edges[0], position_edges[-1]]
+    segments, orientations = trajectorySegments(files)
+
+    if orientation is not None:
+        density = trajectoryDensity(segments, orientations, time_edges, position_edges, orientation)
+        return ax.imshow(density.T, origin='lower', extent=extent, aspect='auto', cmap=cmap, rasterized=True)
+
+    # Mix the colors of both orientations, weighted by their density
+    image = np.ones([len(position_edges) - 1, len(time_edges) - 1, 3])
+    for o in [1, -1]:
+        density = trajectoryDensity(segments, orientations, time_edges, position_edges, o).T
+        if density.max() > 0:
+            density = density / density.max()
+        color = np.array(to_rgb(colors[o]))
+        image -= density[:, :, np.newaxis] * (1 - color)
+    return ax.imshow(np.clip(image, 0, 1), origin='lower', extent=extent, aspect='auto', rasterized=True)
@@ -1,6 +1,7 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
+from seed_store import readEvents
 
 
 append = ['wt','ase1_1','ase1_2','ase1_3','ase1_4']
@@ -13,7 +14,8 @@ files = [
 ]
 
 for j in range(5):
-    data = np.genfromtxt(files[j],delimiter=' ')
+    # If only the seed of the replicate was stored, this regenerates the trajectory
+    data = readEvents(files[j])
 
     mt_ids = data[:,0]
     sim_time = data[:,1]
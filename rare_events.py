@@ -0,0 +1,151 @@
+"""
+Estimation of small probabilities of spindle breakage with adaptive multilevel splitting (AMS).
+
+A reaction coordinate (score) measures how close a simulation is to breaking. N trajectories are run, and at each
+iteration the ones that reached the lowest maximum score are killed and replaced by clones of surviving trajectories,
+branched at the first time at which they exceeded that score. The probability of breaking before par.max_time is
+estimated as the product of the fractions of survivors at each iteration times the fraction of trajectories that break
+at the end. This estimate is unbiased, and its error is estimated from independent AMS runs (see amsEstimate).
+
+Trajectories are not stored: each one is represented by the state at which it starts (the initial state, or the state
+where it was branched) and the seed used from there, and the branching state is found by replaying the trajectory
+(see Simulation::__init__ for determinism).
+"""
+import copy
+from random import Random
+import numpy as np
+from simulation import Simulation, stopWhenBroken
+from event_sinks import NullSink
+
+
+def overlapScore(sim):
+    """
+    Reaction coordinate: minus the overlap between antiparallel microtubules (see Simulation::spindleOverlap), which
+    approaches zero when the spindle is about to break
+    :param sim:
+    :type sim: Simulation
+    :return:
+    """
+    return -sim.spindleOverlap()
+
+
+def lostScore(sim):
+    """
+    Reaction coordinate: the number of lost microtubules
+    :param sim:
+    :type sim: Simulation
+    :return:
+    """
+    return sum(mt.lost for mt in sim.microtubules)
+
+
+class Trajectory:
+
+    def __init__(self, start_state, seed, start_score):
+        """
+        :param start_state: the state from which the trajectory starts, it is not modified
+        :type start_state: Simulation
+        :param seed: the seed of the random number generator from start_state
+        :param start_score: the maximum score reached before start_state (by the parent trajectory)
+        """
+        self.start_state = start_state
+        self.seed = seed
+        self.start_score = start_score
+
+        # The maximum score reached by the trajectory, inf if the spindle breaks before par.max_time
+        self.level = None
+
+    def replay(self, score, level=None):
+        """
+        Run the trajectory from start_state. If level is None, run until the end and set self.level, otherwise stop
+        the first time that the maximum score exceeds level.
+        :param score: the reaction coordinate, a function of the simulation
+        :param level:
+        :return: the state of the simulation when it stops, the maximum score until then and the number of dt steps
+        """
+        sim = copy.deepcopy(self.start_state)
+        sim.rng.seed(self.seed)
+        max_score = self.start_score
+        nb_steps = 0
+
+        while sim.t < sim.par.max_time and max_score < float('inf') and (level is None or max_score <= level):
+            nb_steps += 1
+            if sim.advance(stopWhenBroken):
+                max_score = float('inf')
+                break
+            max_score = max(max_score, score(sim))
+
+        if level is None:
+            self.level = max_score
+        return sim, max_score, nb_steps
+
+
+def amsRun(par, score=overlapScore, nb_particles=100, seed=None):
+    """
+    A single AMS estimation of the probability that the spindle breaks before par.max_time
+    :param par:
+    :type par: Parameters
+    :param score: the reaction coordinate, see overlapScore and lostScore
+    :param nb_particles: number of trajectories kept at all times
+    :param seed:
+    :return: the estimated probability, and the number of dt steps simulated
+    """
+    rng = Random(seed)
+    nb_steps = 0
+
+    particles = list()
+    for _ in range(nb_particles):
+        start_state = Simulation(par, rng.getrandbits(32), NullSink())
+        particle = Trajectory(start_state, rng.getrandbits(32), score(start_state))
+        nb_steps += particle.replay(score)[2]
+        particles.append(particle)
+
+    probability = 1.
+    while True:
+        levels = np.array([particle.level for particle in particles])
+        level = np.min(levels)
+        if level == float('inf'):
+            break
+
+        # All trajectories at the lowest level are killed
+        killed = np.flatnonzero(levels <= level)
+        survivors = np.flatnonzero(levels > level)
+        if len(survivors) == 0:
+            # None of the trajectories progressed further, the estimate is zero
+            probability = 0.
+            break
+        probability *= 1. - len(killed) / float(nb_particles)
+
+        # Each killed trajectory is replaced by a clone of a random survivor, branched when it first exceeded the level
+        for i in killed:
+            parent = particles[survivors[rng.randrange(len(survivors))]]
+            branch_state, branch_score, parent_steps = parent.replay(score, level)
+            particles[i] = Trajectory(branch_state, rng.getrandbits(32), branch_score)
+            nb_steps += parent_steps + particles[i].replay(score)[2]
+
+    probability *= np.mean([particle.level == float('inf') for particle in particles])
+    return probability, nb_steps
+
+
+def amsEstimate(par, score=overlapScore, nb_particles=100, nb_runs=20, seed=None, n_jobs=1):
+    """
+    Probability that the spindle breaks before par.max_time, estimated as the mean of nb_runs independent AMS runs
+    :param par:
+    :type par: Parameters
+    :param score: see amsRun
+    :param nb_particles: see amsRun
+    :param nb_runs: number of independent AMS runs
+    :param seed:
+    :param n_jobs: number of parallel jobs (requires joblib if larger than 1)
+    :return: the estimated probability, its standard error, and the total number of dt steps simulated
+    """
+    seeds = [Random(seed).getrandbits(32) + i for i in range(nb_runs)]
+    if n_jobs == 1:
+        results = [amsRun(par, score, nb_particles, s) for s in seeds]
+    else:
+        from joblib import Parallel, delayed
+        results = Parallel(n_jobs=n_jobs, verbose=1)(delayed(amsRun)(par, score, nb_particles, s) for s in seeds)
+
+    estimates = np.array([r[0] for r in results])
+    nb_steps = sum(r[1] for r in results)
+    return np.mean(estimates), np.std(estimates, ddof=1) / np.sqrt(nb_runs), nb_steps
@@ -0,0 +1,220 @@
+"""
+Streaming reducers to summarise the output of many replicates with constant memory.
+
+    Histogram: counts in fixed bins
+    QuantileSketch: approximate quantiles with a bounded relative error
+    Reservoir: uniform random sample of fixed size
+    GridMoments: mean and variance at each point of a fixed grid (e.g. time)
+
+Values are added with add, and reducers of the same type and settings (e.g. computed by different workers) are combined
+with merge. The merge of Histogram and QuantileSketch is exact (the result is the same as if all values had been added
+to a single reducer), GridMoments is exact up to floating point rounding, and the merged Reservoir is a uniform sample
+of all the values.
+"""
+from math import log
+from random import Random
+import numpy as np
+
+
+class Histogram:
+
+    def __init__(self, edges):
+        """
+        :param edges: the edges of the bins, values outside are counted in underflow and overflow
+        """
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        self.counts += np.histogram(values, self.edges)[0]
+        self.underflow += np.count_nonzero(values < self.edges[0])
+        self.overflow += np.count_nonzero(values > self.edges[-1])
+
+    def merge(self, other):
+        """
+        :type other: Histogram
+        """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('Cannot merge histograms with different edges')
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+    def toArray(self):
+        """
+        :return: array with a row per bin (left edge, right edge, count)
+        """
+        return np.column_stack((self.edges[:-1], self.edges[1:], self.counts))
+
+
+class QuantileSketch:
+    """
+    Values are counted in logarithmic buckets of their absolute value, so that any quantile is returned with a relative
+    error smaller than relative_accuracy (as in DDSketch, Masson et al. 2019). The number of buckets grows with the
+    logarithm of the range of the values, not with the number of values.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-6):
+        """
+        :param relative_accuracy:
+        :param min_value: values with absolute value smaller than this are counted as zero
+        """
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = log(self.gamma)
+        self.positive = dict()
+        self.negative = dict()
+        self.zero = 0
+        self.count = 0
+
+    def addToStore(self, store, values):
+        indexes = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        for index, count in zip(*np.unique(indexes, return_counts=True)):
+            store[int(index)] = store.get(int(index), 0) + int(count)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[np.logical_not(np.isnan(values))]
+        self.count += len(values)
+        self.addToStore(self.positive, values[values >= self.min_value])
+        self.addToStore(self.negative, -values[values <= -self.min_value])
+        self.zero += np.count_nonzero(np.abs(values) < self.min_value)
+
+    def merge(self, other):
+        """
+        :type other: QuantileSketch
+        """
+        if other.relative_accuracy != self.relative_accuracy or other.min_value != self.min_value:
+            raise ValueError('Cannot merge quantile sketches with different settings')
+        for store, other_store in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for index, count in other_store.items():
+                store[index] = store.get(index, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+
+    def bucketValue(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        """
+        :param q: between 0 and 1
+        :return: the approximate quantile, nan if no values were added
+        """
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+
+        # Iterate buckets in increasing order of value
+        buckets = [(-self.bucketValue(i), c) for i, c in sorted(self.negative.items(), reverse=True)]
+        buckets += [(0., self.zero)]
+        buckets += [(self.bucketValue(i), c) for i, c in sorted(self.positive.items())]
+        cumulative = 0
+        for value, count in buckets:
+            cumulative += count
+            if cumulative > rank:
+                return value
+        return buckets[-1][0]
+
+    def toArray(self, quantiles):
+        """
+        :param quantiles: the values of q
+        :return: array with a row per quantile (q, value)
+        """
+        return np.array([[q, self.quantile(q)] for q in quantiles])
+
+
+class Reservoir:
+    """
+    Uniform random sample of size at most size of all the values added (reservoir sampling)
+    """
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.rng = Random(seed)
+        self.sample = list()
+        self.count = 0
+
+    def add(self, values):
+        for value in values:
+            self.count += 1
+            if len(self.sample) < self.size:
+                self.sample.append(value)
+            else:
+                index = self.rng.randrange(self.count)
+                if index < self.size:
+                    self.sample[index] = value
+
+    def merge(self, other):
+        """
+        :type other: Reservoir
+        """
+        total = self.count + other.count
+        nb_sampled = min(self.size, len(self.sample) + len(other.sample))
+
+        # The number of sampled values that come from self follows a hypergeometric distribution
+        nb_self = 0
+        remaining_self, remaining = self.count, total
+        for _ in range(nb_sampled):
+            if self.rng.randrange(remaining) < remaining_self:
+                nb_self += 1
+                remaining_self -= 1
+            remaining -= 1
+        nb_self = min(nb_self, len(self.sample))
+        nb_other = min(nb_sampled - nb_self, len(other.sample))
+
+        self.sample = self.rng.sample(self.sample, nb_self) + self.rng.sample(other.sample, nb_other)
+        self.count = total
+
+
+class GridMoments:
+    """
+    Online mean and variance (Welford) of values given on a fixed grid. Nan values are skipped, so the number of values
+    can be different at each grid point.
+    """
+
+    def __init__(self, nb_points):
+        self.count = np.zeros(nb_points, dtype=np.int64)
+        self.mean = np.zeros(nb_points)
+        self.m2 = np.zeros(nb_points)
+
+    def add(self, values):
+        """
+        :param values: array with a value per grid point
+        """
+        values = np.asarray(values, dtype=float)
+        idxs = np.logical_not(np.isnan(values))
+        self.count[idxs] += 1
+        delta = values[idxs] - self.mean[idxs]
+        self.mean[idxs] += delta / self.count[idxs]
+        self.m2[idxs] += delta * (values[idxs] - self.mean[idxs])
+
+    def merge(self, other):
+        """
+        :type other: GridMoments
+        """
+        count = self.count + other.count
+        idxs = count > 0
+        delta = other.mean[idxs] - self.mean[idxs]
+        self.mean[idxs] += delta * other.count[idxs] / count[idxs]
+        self.m2[idxs] += other.m2[idxs] + delta ** 2 * self.count[idxs] * other.count[idxs] / count[idxs]
+        self.count = count
+
+    def variance(self):
+        """
+        :return: the sample variance at each grid point (nan where there are less than two values)
+        """
+        out = np.full(len(self.count), np.nan)
+        idxs = self.count > 1
+        out[idxs] = self.m2[idxs] / (self.count[idxs] - 1)
+        return out
+
+    def toArray(self):
+        """
+        :return: array with a row per grid point (count, mean, variance)
+        """
+        mean = np.where(self.count > 0, self.mean, np.nan)
+        return np.column_stack((self.count, mean, self.variance()))
@@ -2,6 +2,7 @@ from simulation import Simulation, Parameters
 import numpy as np
 import os
 from joblib import Parallel, delayed
+from seed_store import runSeedOnly
 
 
 p = Parameters()
@@ -19,6 +20,9 @@ p.rearrange_mts = False
 
 main_dir = "runs_ase1"
 
+# If True, store only the seed and summary stats of each replicate instead of the full output (see seed_store.py)
+seed_only = False
+
 def runSim(label,i,par):
 
     sim = Simulation(par)
@@ -28,7 +32,10 @@ def runSim(label,i,par):
 
 for i, resc in enumerate(np.arange(1, 120, 3)):
     print(i)
-    os.makedirs('%s/runs_%.1f' % (main_dir,resc), exist_ok=True)
     p.total_rescue = resc
+    if seed_only:
+        runSeedOnly(p, '%s/runs_%.1f' % (main_dir,resc), 200, n_jobs=20)
+        continue
+    os.makedirs('%s/runs_%.1f' % (main_dir,resc), exist_ok=True)
     Parallel(n_jobs=20,verbose=1)(delayed(runSim)(resc,i,p) for i in range(200))
 
@@ -2,6 +2,8 @@ from simulation import Simulation, Parameters
 import numpy as np
 import os
 from joblib import Parallel, delayed
+from batch_simulation import runBatched
+import copy
 
 
 p = Parameters()
@@ -19,6 +21,9 @@ p.total_rescue = 55.0
 
 main_dir = "runs_speed_beta"
 
+# If True, all conditions are run together in vectorized batches (see batch_simulation.py)
+batched = False
+
 def runSim(label,a,i,par):
 
     sim = Simulation(par)
@@ -26,13 +31,31 @@ def runSim(label,a,i,par):
     with open("%s/runs_%.4f_%d/result_%02d.csv" % (main_dir,label,a, i), 'w') as out:
         out.write(output)
 
-for j, v_growth in enumerate(np.arange(0.35, 1.5, 0.125/4.)):
+if batched:
+    conditions = list()
+    for v_growth in np.arange(0.35, 1.5, 0.125/4.):
+        for a in [4, 8, 12]:
+            if os.path.isdir('%s/runs_%.4f_%d' % (main_dir, v_growth, a)):
+                continue
+            p.v_growth = v_growth
+            p.alpha = a
+            conditions.append(copy.copy(p))
+
+    results = runBatched(conditions, 500, batch_size=2000, n_jobs=20)
+    for condition, outputs in zip(conditions, results):
+        condition_dir = '%s/runs_%.4f_%d' % (main_dir, condition.v_growth, condition.alpha)
+        os.makedirs(condition_dir, exist_ok=True)
+        for i, output in enumerate(outputs):
+            with open("%s/result_%02d.csv" % (condition_dir, i), 'w') as out:
+                out.write(output)
+else:
+    for j, v_growth in enumerate(np.arange(0.35, 1.5, 0.125/4.)):
 
-    p.v_growth = v_growth
-    for a in [4, 8, 12]:
-        print(j,a)
-        p.alpha = a
-        if os.path.isdir('%s/runs_%.4f_%d' % (main_dir, v_growth, a)):
-            continue
-        os.makedirs('%s/runs_%.4f_%d' % (main_dir, v_growth, a), exist_ok=True)
-        Parallel(n_jobs=20,verbose=1)(delayed(runSim)(v_growth,a,i,p) for i in range(500))
+        p.v_growth = v_growth
+        for a in [4, 8, 12]:
+            print(j,a)
+            p.alpha = a
+            if os.path.isdir('%s/runs_%.4f_%d' % (main_dir, v_growth, a)):
+                continue
+            os.makedirs('%s/runs_%.4f_%d' % (main_dir, v_growth, a), exist_ok=True)
+            Parallel(n_jobs=20,verbose=1)(delayed(runSim)(v_growth,a,i,p) for i in range(500))
@@ -0,0 +1,28 @@
+from simulation import Parameters
+import numpy as np
+import os
+from adaptive_sweep import adaptiveSweep1D
+
+
+p = Parameters()
+p.v_slide = 0.35
+p.v_growth = 1.6
+p.v_shrink = 3.6
+p.dt = 0.01
+p.duration_n = 8.53
+p.duration_r = 3.17
+p.midzone_mu = 1.23
+p.midzone_sigma = 0.25
+p.ase1 = False
+p.rearrange_mts = True
+
+
+main_dir = "runs_wt_adaptive"
+
+# Same range as runs_wt.py, but the points concentrate where the survival fraction changes
+total_rescue, survival, survival_error = adaptiveSweep1D(p, 'total_rescue', 1, 120, nb_coarse=9, nb_replicates=200,
+                                                         max_points=40, min_step=0.5, n_jobs=20)
+
+os.makedirs(main_dir, exist_ok=True)
+np.savetxt(os.path.join(main_dir, 'survival.csv'), np.column_stack((total_rescue, survival, survival_error)),
+           header='total_rescue survival survival_error')
@@ -0,0 +1,236 @@
+"""
+Seed-only storage of parameter sweeps.
+
+Instead of writing the full event log of every replicate (result_XX.csv), each condition directory contains:
+
+    parameters.json: the parameters of the condition and their hash
+    replicates.txt: one line per replicate with the replicate index, the parameter hash, the seed and summary stats
+
+Since the simulation is deterministic for a given seed (see Simulation::__init__), the full event log of any replicate
+can be regenerated on demand with regenerateReplicate, or transparently with readEvents. The regenerated replicate is
+checked against the stored summary stats, to detect changes in the simulation code since the sweep was run.
+"""
+import os
+import io
+import json
+import hashlib
+import numpy as np
+from simulation import Simulation, Parameters, engine_version
+
+# Fields of Parameters that do not change the output of the simulation, and are not included in the hash
+output_only_fields = ['print_linkers']
+
+# Columns of replicates.txt
+replicate_fields = ['replicate', 'param_hash', 'seed', 't_end', 'broken', 'nb_lost', 'nb_catastrophes', 'nb_rescues']
+
+
+def parameterDict(par):
+    """
+    Return the parameters that define the simulation output as a dictionary of plain python values
+    :param par:
+    :type par: Parameters
+    :return:
+    """
+    out = dict()
+    for key, value in par.__dict__.items():
+        if key in output_only_fields:
+            continue
+        # Convert numpy scalars (e.g. from np.arange in the sweeps) into python values
+        out[key] = value.item() if isinstance(value, np.generic) else value
+    return out
+
+
+def parameterHash(par):
+    """
+    A short hash that identifies a set of parameters
+    :param par:
+    :type par: Parameters
+    :return:
+    """
+    return dictHash(parameterDict(par))
+
+
+def dictHash(par_dict):
+    """
+    See parameterHash
+    :param par_dict: the output of parameterDict
+    :return:
+    """
+    content = json.dumps(par_dict, sort_keys=True)
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+def parametersFromDict(par_dict):
+    """
+    Inverse of parameterDict
+    :param par_dict:
+    :return:
+    """
+    par = Parameters()
+    for key, value in par_dict.items():
+        setattr(par, key, value)
+    return par
+
+
+def replicateSeed(param_hash, replicate):
+    """
+    The seed of a replicate, derived from the parameter hash and the replicate index, so that re-running a sweep gives
+    the same results
+    :param param_hash:
+    :param replicate:
+    :return:
+    """
+    content = '%s_%d' % (param_hash, replicate)
+    return int(hashlib.sha1(content.encode()).hexdigest()[:8], 16)
+
+
+def summarizeSimulation(sim, log):
+    """
+    Summary stats of a simulation that has been run
+    :param sim:
+    :type sim: Simulation
+    :param log: the output of Simulation::run
+    :return:
+    """
+    event_type = [line.split(' ')[3] for line in log.splitlines()]
+    return {
+        't_end': sim.t,
+        'broken': sim.checkBrokenSpindle(),
+        'nb_lost': event_type.count('2'),
+        'nb_catastrophes': event_type.count('0'),
+        'nb_rescues': event_type.count('1'),
+    }
+
+
+def runReplicate(par, seed):
+    """
+    Run a single replicate and return its full event log (the content of a result_XX.csv file)
+    :param par:
+    :type par: Parameters
+    :param seed:
+    :return:
+    """
+    sim = Simulation(par, seed)
+    return sim.run()
+
+
+def runSummary(par, param_hash, replicate):
+    """
+    Run a single replicate and return the line of replicates.txt corresponding to it
+    :param par:
+    :param param_hash:
+    :param replicate:
+    :return:
+    """
+    seed = replicateSeed(param_hash, replicate)
+    sim = Simulation(par, seed)
+    summary = summarizeSimulation(sim, sim.run())
+    return '%u %s %u %s\n' % (replicate, param_hash, seed, formatSummary(summary))
+
+
+def formatSummary(summary):
+    """
+    The summary stats as written in replicates.txt
+    :param summary: the output of summarizeSimulation
+    :return:
+    """
+    return '%.2f %i %u %u %u' % (summary['t_end'], summary['broken'], summary['nb_lost'], summary['nb_catastrophes'],
+                                 summary['nb_rescues'])
+
+
+def runSeedOnly(par, condition_dir, nb_replicates, n_jobs=1):
+    """
+    Run nb_replicates simulations and store only their parameters, seeds and summary stats in condition_dir
+    :param par:
+    :type par: Parameters
+    :param condition_dir:
+    :param nb_replicates:
+    :param n_jobs: number of parallel jobs (requires joblib if larger than 1)
+    :return:
+    """
+    os.makedirs(condition_dir, exist_ok=True)
+    param_hash = parameterHash(par)
+
+    with open(os.path.join(condition_dir, 'parameters.json'), 'w') as out:
+        json.dump({'param_hash': param_hash, 'parameters': parameterDict(par), 'engine_version': engine_version}, out,
+                  indent=4, sort_keys=True)
+
+    if n_jobs == 1:
+        lines = [runSummary(par, param_hash, i) for i in range(nb_replicates)]
+    else:
+        from joblib import Parallel, delayed
+        lines = Parallel(n_jobs=n_jobs, verbose=1)(delayed(runSummary)(par, param_hash, i)
+                                                    for i in range(nb_replicates))
+
+    with open(os.path.join(condition_dir, 'replicates.txt'), 'w') as out:
+        out.write('# ' + ' '.join(replicate_fields) + '\n')
+        out.writelines(lines)
+
+
+def readReplicates(condition_dir):
+    """
+    Read the replicates.txt file of a condition, returns a list of dictionaries
+    :param condition_dir:
+    :return:
+    """
+    replicates = list()
+    with open(os.path.join(condition_dir, 'replicates.txt')) as ins:
+        for line in ins:
+            if line.startswith('#'):
+                continue
+            values = line.split()
+            replicate = dict(zip(replicate_fields, values))
+            for key in replicate_fields:
+                if key == 'param_hash':
+                    continue
+                replicate[key] = float(replicate[key]) if key == 't_end' else int(replicate[key])
+            replicates.append(replicate)
+    return replicates
+
+
+def regenerateReplicate(condition_dir, replicate):
+    """
+    Re-run a replicate stored with runSeedOnly and return its full event log
+    :param condition_dir:
+    :param replicate: the replicate index
+    :return:
+    """
+    with open(os.path.join(condition_dir, 'parameters.json')) as ins:
+        stored = json.load(ins)
+
+    par = parametersFromDict(stored['parameters'])
+    if dictHash(stored['parameters']) != stored['param_hash']:
+        raise ValueError('The parameters in %s do not match their hash' % condition_dir)
+
+    for rep in readReplicates(condition_dir):
+        if rep['replicate'] == replicate:
+            if rep['param_hash'] != stored['param_hash']:
+                raise ValueError('Replicate %d of %s was run with different parameters' % (replicate, condition_dir))
+            sim = Simulation(par, rep['seed'])
+            log = sim.run()
+
+            # The regenerated replicate must have the same summary stats as the stored one
+            stored_summary = formatSummary(dict((key, rep[key]) for key in replicate_fields[3:]))
+            if formatSummary(summarizeSimulation(sim, log)) != stored_summary:
+                raise ValueError('Replicate %d of %s does not match its stored summary, it was run with engine version '
+                                 '%s and the current version is %d' % (replicate, condition_dir,
+                                                                       stored.get('engine_version'), engine_version))
+            return log
+
+    raise ValueError('Replicate %d not found in %s' % (replicate, condition_dir))
+
+
+def readEvents(result_file):
+    """
+    Read the events of a result_XX.csv file as a numpy array (like np.genfromtxt). If the file does not exist, but the
+    condition directory was stored with runSeedOnly, the replicate is regenerated.
+    :param result_file: e.g. runs_ase1/runs_34.0/result_05.csv
+    :return:
+    """
+    if os.path.isfile(result_file):
+        return np.genfromtxt(result_file, delimiter=' ')
+
+    condition_dir, file_name = os.path.split(result_file)
+    replicate = int(file_name[len('result_'):-len('.csv')])
+    log = regenerateReplicate(condition_dir, replicate)
+    return np.genfromtxt(io.StringIO(log), delimiter=' ')
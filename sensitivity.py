@@ -0,0 +1,284 @@
+"""
+Global sensitivity analysis of the simulation with respect to fields of Parameters.
+
+Two designs are available:
+
+    Sobol: first order and total indices (Saltelli 2010 and Jansen estimators), from nb_base * (nb_fields + 2) points
+    Morris: mean of the absolute elementary effects (mu_star) and their standard deviation, from
+        nb_trajectories * (nb_fields + 1) points, useful as a cheaper screening
+
+At each point of the design, nb_replicates simulations are run and the output is the mean of a replicate summary (by
+default whether the spindle survives until par.max_time, see adaptive_sweep.survived). All the simulations of a design
+are run in a single parallel batch, and their results can be stored in a ResultCache, so that they are reused when the
+analysis is repeated or extended (replicates are seeded with seed_store.replicateSeed, so they are reproducible).
+Confidence intervals are obtained by bootstrap over the points of the design.
+
+Example:
+
+    ranges = {'v_growth': (0.5, 2.), 'v_shrink': (2., 5.), 'total_rescue': (10., 100.)}
+    result = sobolAnalysis(p, ranges, nb_base=256, nb_replicates=20, n_jobs=20, cache=ResultCache('cache.csv'))
+"""
+import os
+import numpy as np
+from scipy.stats import qmc
+from adaptive_sweep import survived, runReplicateSummary, pointParameters
+from seed_store import parameterHash
+
+
+class ResultCache:
+    """
+    Stores the summary of each replicate, indexed by the hash of the parameters, the name of the replicate summary and
+    the replicate index, so that the values of different summaries are never mixed (max_time is one of the parameters,
+    so it is part of the hash). If a path is given, the results are read from it and new results are appended to it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.values = dict()
+        if path is not None and os.path.isfile(path):
+            with open(path) as ins:
+                for line in ins:
+                    param_hash, summary_name, replicate, value = line.split()
+                    self.values[(param_hash, summary_name, int(replicate))] = float(value)
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def update(self, new_values):
+        """
+        :param new_values: a dictionary (param_hash, summary_name, replicate) -> value
+        :return:
+        """
+        # Convert numpy scalars to python floats, so that the values are written as plain numbers
+        new_values = {key: float(value) for key, value in new_values.items()}
+        self.values.update(new_values)
+        if self.path is not None:
+            with open(self.path, 'a') as out:
+                for (param_hash, summary_name, replicate), value in new_values.items():
+                    out.write('%s %s %u %r\n' % (param_hash, summary_name, replicate, value))
+
+
+def scaleDesign(unit_design, ranges):
+    """
+    Scale points in the unit hypercube to the ranges of the fields
+    :param unit_design: array (nb_points, nb_fields) with values in [0, 1]
+    :param ranges: a dictionary field -> (low, high)
+    :return:
+    """
+    bounds = np.array(list(ranges.values()), dtype=float)
+    return bounds[:, 0] + unit_design * (bounds[:, 1] - bounds[:, 0])
+
+
+def evaluateDesign(par, fields, design, nb_replicates, replicate_summary=survived, n_jobs=1, cache=None,
+                   summary_name=None):
+    """
+    Run the simulations of a design
+    :param par: the parameters that are not varied
+    :type par: Parameters
+    :param fields: the names of the varied fields
+    :param design: array (nb_points, nb_fields) with the values of the fields at each point
+    :param nb_replicates: simulations per point
+    :param replicate_summary: a function that takes the simulation after running and returns a number
+    :param n_jobs: number of parallel jobs (requires joblib if larger than 1)
+    :param cache: a ResultCache, replicates that are already in it are not run
+    :type cache: ResultCache
+    :param summary_name: the name under which the values of replicate_summary are stored in the cache, by default the
+    name of the function. It must be given if replicate_summary is a lambda, and it must be changed if the function
+    changes.
+    :return: array (nb_points,) with the mean of the replicate summaries at each point
+    """
+    if summary_name is None:
+        summary_name = replicate_summary.__name__
+    if cache is None:
+        cache = ResultCache()
+    elif summary_name == '<lambda>':
+        raise ValueError('summary_name must be given to cache the values of a lambda')
+
+    point_pars = [pointParameters(par, fields, point) for point in design]
+    point_hashes = [parameterHash(point_par) for point_par in point_pars]
+
+    # Replicates that are not in the cache, a point can appear more than once in a design but it is run only once
+    tasks = list()
+    pending = set()
+    for i, param_hash in enumerate(point_hashes):
+        for replicate in range(nb_replicates):
+            key = (param_hash, summary_name, replicate)
+            if key not in cache and key not in pending:
+                pending.add(key)
+                tasks.append((i, replicate))
+
+    if n_jobs == 1:
+        values = [runReplicateSummary(point_pars[i], replicate, replicate_summary) for i, replicate in tasks]
+    else:
+        from joblib import Parallel, delayed
+        values = Parallel(n_jobs=n_jobs, verbose=1)(
+            delayed(runReplicateSummary)(point_pars[i], replicate, replicate_summary) for i, replicate in tasks)
+
+    cache.update({(point_hashes[i], summary_name, replicate): value for (i, replicate), value in zip(tasks, values)})
+
+    return np.array([np.mean([cache[(param_hash, summary_name, replicate)] for replicate in range(nb_replicates)])
+                     for param_hash in point_hashes])
+
+
+def sobolDesign(ranges, nb_base, seed=None):
+    """
+    The Saltelli design to compute Sobol indices, built from a scrambled Sobol sequence
+    :param ranges: a dictionary field -> (low, high)
+    :param nb_base: number of base points, should be a power of 2
+    :param seed:
+    :return: the matrices A and B (nb_base, nb_fields), and AB (nb_fields, nb_base, nb_fields), where AB[i] is A with
+    the column i taken from B
+    """
+    nb_fields = len(ranges)
+    unit_design = qmc.Sobol(2 * nb_fields, seed=seed).random(nb_base)
+    A = scaleDesign(unit_design[:, :nb_fields], ranges)
+    B = scaleDesign(unit_design[:, nb_fields:], ranges)
+    AB = np.tile(A, (nb_fields, 1, 1))
+    for i in range(nb_fields):
+        AB[i, :, i] = B[:, i]
+    return A, B, AB
+
+
+def sobolIndices(f_A, f_B, f_AB):
+    """
+    First order (Saltelli 2010) and total (Jansen) Sobol indices
+    :param f_A: output at A (nb_base,)
+    :param f_B: output at B (nb_base,)
+    :param f_AB: output at AB (nb_fields, nb_base)
+    :return: arrays (nb_fields,) with the first order and total indices
+    """
+    variance = np.var(np.concatenate((f_A, f_B)))
+    if variance == 0:
+        return np.full(len(f_AB), np.nan), np.full(len(f_AB), np.nan)
+    first_order = np.mean(f_B * (f_AB - f_A), axis=1) / variance
+    total = 0.5 * np.mean((f_A - f_AB) ** 2, axis=1) / variance
+    return first_order, total
+
+
+def bootstrapInterval(statistic, nb_samples, nb_bootstrap, confidence, seed):
+    """
+    Percentile bootstrap confidence interval of a statistic computed from a set of samples
+    :param statistic: a function that takes an array of sample indexes and returns an array of values
+    :param nb_samples:
+    :param nb_bootstrap:
+    :param confidence:
+    :param seed:
+    :return: arrays with the lower and upper bounds of the interval
+    """
+    rng = np.random.default_rng(seed)
+    resampled = np.array([statistic(rng.integers(0, nb_samples, nb_samples)) for _ in range(nb_bootstrap)])
+    tail = (1 - confidence) / 2. * 100
+    return np.nanpercentile(resampled, tail, axis=0), np.nanpercentile(resampled, 100 - tail, axis=0)
+
+
+def sobolAnalysis(par, ranges, nb_base, nb_replicates, replicate_summary=survived, n_jobs=1, cache=None,
+                  nb_bootstrap=1000, confidence=0.95, seed=None, summary_name=None):
+    """
+    Compute the Sobol indices of the fields in ranges
+    :param par: the parameters that are not varied
+    :type par: Parameters
+    :param ranges: a dictionary field -> (low, high)
+    :param nb_base: see sobolDesign
+    :return: a dictionary with the fields, the first order and total indices and their confidence intervals (lower and
+    upper bound arrays)
+    See evaluateDesign and bootstrapInterval for the rest of arguments.
+    """
+    fields = list(ranges.keys())
+    nb_fields = len(fields)
+    A, B, AB = sobolDesign(ranges, nb_base, seed)
+
+    # All points are evaluated in a single batch
+    design = np.concatenate((A, B, AB.reshape(-1, nb_fields)))
+    output = evaluateDesign(par, fields, design, nb_replicates, replicate_summary, n_jobs, cache, summary_name)
+    f_A = output[:nb_base]
+    f_B = output[nb_base:2 * nb_base]
+    f_AB = output[2 * nb_base:].reshape(nb_fields, nb_base)
+
+    first_order, total = sobolIndices(f_A, f_B, f_AB)
+    first_order_conf = bootstrapInterval(lambda idx: sobolIndices(f_A[idx], f_B[idx], f_AB[:, idx])[0],
+                                         nb_base, nb_bootstrap, confidence, seed)
+    total_conf = bootstrapInterval(lambda idx: sobolIndices(f_A[idx], f_B[idx], f_AB[:, idx])[1],
+                                   nb_base, nb_bootstrap, confidence, seed)
+
+    return {
+        'fields': fields,
+        'first_order': first_order,
+        'first_order_conf': first_order_conf,
+        'total': total,
+        'total_conf': total_conf,
+    }
+
+
+def morrisDesign(ranges, nb_trajectories, nb_levels=4, seed=None):
+    """
+    Morris trajectories: each trajectory starts at a random point of a grid with nb_levels per field, and changes one
+    field at a time (in random order) by delta = nb_levels / (2 * (nb_levels - 1)) in unit scale
+    :param ranges: a dictionary field -> (low, high)
+    :param nb_trajectories:
+    :param nb_levels: should be even
+    :param seed:
+    :return: the design (nb_trajectories * (nb_fields + 1), nb_fields), the order in which fields change in each
+    trajectory (nb_trajectories, nb_fields) and delta
+    """
+    rng = np.random.default_rng(seed)
+    nb_fields = len(ranges)
+    delta = nb_levels / (2. * (nb_levels - 1))
+
+    # Starting points are chosen in the levels for which adding delta stays inside [0, 1]
+    starting_levels = np.arange(nb_levels // 2) / (nb_levels - 1.)
+
+    unit_design = np.empty([nb_trajectories, nb_fields + 1, nb_fields])
+    orders = np.empty([nb_trajectories, nb_fields], dtype=int)
+    for t in range(nb_trajectories):
+        point = rng.choice(starting_levels, nb_fields)
+        orders[t] = rng.permutation(nb_fields)
+        unit_design[t, 0] = point
+        for step, field_index in enumerate(orders[t]):
+            point = point.copy()
+            point[field_index] += delta
+            unit_design[t, step + 1] = point
+
+    return scaleDesign(unit_design.reshape(-1, nb_fields), ranges), orders, delta
+
+
+def morrisEffects(output, orders, delta):
+    """
+    Elementary effects of each field in each trajectory, in units of the output per unit-scale change of the field
+    :param output: output at the points of morrisDesign
+    :param orders: see morrisDesign
+    :param delta: see morrisDesign
+    :return: array (nb_trajectories, nb_fields)
+    """
+    nb_trajectories, nb_fields = orders.shape
+    differences = np.diff(output.reshape(nb_trajectories, nb_fields + 1), axis=1) / delta
+    effects = np.empty_like(differences)
+    for t in range(nb_trajectories):
+        effects[t, orders[t]] = differences[t]
+    return effects
+
+
+def morrisAnalysis(par, ranges, nb_trajectories, nb_replicates, nb_levels=4, replicate_summary=survived, n_jobs=1,
+                   cache=None, nb_bootstrap=1000, confidence=0.95, seed=None, summary_name=None):
+    """
+    Compute the Morris screening measures of the fields in ranges
+    :param par: the parameters that are not varied
+    :type par: Parameters
+    :param ranges: a dictionary field -> (low, high)
+    :return: a dictionary with the fields, mu_star, its confidence interval (lower and upper bound arrays) and sigma
+    See morrisDesign, evaluateDesign and bootstrapInterval for the rest of arguments.
+    """
+    fields = list(ranges.keys())
+    design, orders, delta = morrisDesign(ranges, nb_trajectories, nb_levels, seed)
+    output = evaluateDesign(par, fields, design, nb_replicates, replicate_summary, n_jobs, cache, summary_name)
+    effects = morrisEffects(output, orders, delta)
+
+    return {
+        'fields': fields,
+        'mu_star': np.mean(np.abs(effects), axis=0),
+        'mu_star_conf': bootstrapInterval(lambda idx: np.mean(np.abs(effects[idx]), axis=0),
+                                          nb_trajectories, nb_bootstrap, confidence, seed),
+        'sigma': np.std(effects, axis=0),
+    }
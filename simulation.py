@@ -1,7 +1,12 @@
-from random import random
+from random import Random
 from math import log, exp
 import numpy as np
 from scipy.stats import beta
+from event_sinks import StringSink
+
+# Version of the simulation algorithm, increase it whenever a change in the code can change the output for a given seed.
+# It is stored with seed-only sweeps to detect replicates that cannot be regenerated (see seed_store.py)
+engine_version = 1
 
 class Parameters:
     """
@@ -23,6 +28,10 @@ class Parameters:
         # The dt for the simulation
         self.dt = 0.0
 
+        # The maximum simulation time, it must be finite: once the spindle breaks, the remaining microtubules can be
+        # rescued indefinitely, so no stop condition is guaranteed to be met (checked in Simulation::__init__)
+        self.max_time = 20.
+
         # We have fit the wild-type data of position of midzone edge to a normal distribution, these are the mu and the
         # sigma of the fit:
         self.midzone_mu = 0.0
@@ -51,25 +60,62 @@ class Parameters:
         self.alpha = 0.0
         self.beta = 2.0
 
+def stopWhenBroken(sim):
+    """
+    Stop condition of Simulation::run: stop when the spindle breaks (the default)
+    """
+    return sim.checkBrokenSpindle()
+
+
+def stopWhenAllLost(sim):
+    """
+    Stop condition of Simulation::run: stop when all microtubules are lost
+    """
+    return all(mt.lost for mt in sim.microtubules)
+
+
+def stopWhenAny(*conditions):
+    """
+    Combine several stop conditions of Simulation::run, stop when any of them is met
+    """
+    return lambda sim: any(condition(sim) for condition in conditions)
+
+
 class Simulation:
 
-    def __init__(self, par):
+    def __init__(self, par, seed=None, sink=None, sample_stride=None):
         """
         :param par:
         :type par:Parameters
+        :param seed: seed of the random number generator. Two simulations with the same parameters and seed produce
+        exactly the same output. If None, the generator is seeded from the operating system.
+        :param sink: where the output is written while the simulation runs (see event_sinks.py), by default it is kept
+        in memory and returned by Simulation::run
+        :param sample_stride: a positive integer, if given the state of all microtubules is recorded every sample_stride
+        steps of dt, in addition to the output (see Simulation::recordSample)
         """
         # An instance of the Parameters class
         self.par = par
+        if not np.isfinite(self.par.max_time):
+            raise ValueError('par.max_time must be finite')
+
+        # The seed and the random number generator of this simulation. All the random numbers of the simulation are
+        # drawn from here, so that any replicate can be regenerated from its seed (see seed_store.py)
+        self.seed = seed
+        self.rng = Random(seed)
 
-        # A string containing the content of the output file (see Simulation::run)
-        self.log = ""
+        # Receives the lines of the output file (see Simulation::run)
+        self.sink = StringSink() if sink is None else sink
 
         # The simulation time
         self.t = 0
 
+        # The number of dt steps simulated
+        self.nb_steps = 0
+
         # We sample the position of the midzone edge by random sample of the normal distribution that we fitted to the
         # midzone edge data.
-        self.midzone_edge = np.random.normal(self.par.midzone_mu, self.par.midzone_sigma, 1)[0]
+        self.midzone_edge = self.rng.gauss(self.par.midzone_mu, self.par.midzone_sigma)
 
         # The array of microtubules (see microtubule class)
         #
@@ -119,12 +165,57 @@ class Simulation:
 
         self.updateProbRescue()
 
+        # Sampling of the state at fixed intervals. Each row of the arrays is a sample, and each column in the
+        # sample_pos, sample_growing and sample_lost arrays corresponds to a microtubule id. The arrays are preallocated
+        # for the maximum number of samples, only the first nb_samples rows are filled.
+        self.sample_stride = sample_stride
+        self.nb_samples = 0
+        if sample_stride is not None:
+            if not isinstance(sample_stride, (int, np.integer)) or isinstance(sample_stride, bool) or sample_stride < 1:
+                raise ValueError('sample_stride must be a positive integer')
+            # One extra step in case rounding errors in Simulation::t add a step
+            nb_samples = int(np.ceil(self.par.max_time / self.par.dt) + 1) // sample_stride + 1
+            self.sample_time = np.full(nb_samples, np.nan)
+            self.sample_half_spindle_length = np.full(nb_samples, np.nan)
+            self.sample_pos = np.full([nb_samples, len(self.microtubules)], np.nan)
+            self.sample_growing = np.zeros([nb_samples, len(self.microtubules)], dtype=bool)
+            self.sample_lost = np.zeros([nb_samples, len(self.microtubules)], dtype=bool)
+            self.recordSample()
+
+    def recordSample(self):
+        """
+        Record the time, half_spindle_length and the position, growing and lost state of all microtubules in the sample
+        arrays (see Simulation::__init__). Called at the start, and every sample_stride steps.
+        :return:
+        """
+        i = self.nb_samples
+        if i == len(self.sample_time):
+            return
+        self.sample_time[i] = self.t
+        self.sample_half_spindle_length[i] = self.half_spindle_length
+        for mt in self.microtubules:
+            self.sample_pos[i, mt.id] = mt.pos
+            self.sample_growing[i, mt.id] = mt.growing
+            self.sample_lost[i, mt.id] = mt.lost
+        self.nb_samples += 1
+
+    def sampleLengths(self):
+        """
+        The length of each microtubule at each sample, nan if the microtubule is lost
+        :return: array (nb_samples, nb_microtubules)
+        """
+        n = self.nb_samples
+        orientation = np.array([mt.orientation for mt in self.microtubules])
+        lengths = self.sample_pos[:n] * orientation + self.sample_half_spindle_length[:n, np.newaxis]
+        lengths[self.sample_lost[:n]] = np.nan
+        return lengths
+
     def timeToNextCatastrophe(self):
         """
         Get the time of next catastrophe by random sample of the distribution (1-exp(-r*t))^n
         :return:
         """
-        prob = random()
+        prob = self.rng.random()
         return -(log(1 - prob ** (1 / self.par.duration_n)) / self.par.duration_r)
 
     def updateProbRescue(self):
@@ -140,9 +231,11 @@ class Simulation:
         # Each linker is counted twice since we iterate through all microtubules
         total_linkers = sum(linkers) / 2.
 
-        # We stop the function just to prevent a warning when dividing by zero (the only case when this function is
-        # called when total_linkers is zero is when the last microtubule depolymerises)
+        # We stop the function to prevent a warning when dividing by zero. Without linkers there are no rescues, which
+        # matters if the simulation continues after the spindle breaks (see Simulation::run)
         if total_linkers==0:
+            self.prob_rescue = [0.] * len(self.microtubules)
+            self.rate_rescue = [0.] * len(self.microtubules)
             return
 
         # The rescue density is homogeneously distributed
@@ -174,9 +267,23 @@ class Simulation:
             if not mt.lost:
                 total_length += mt.pos * mt.orientation + self.half_spindle_length
 
+        # All microtubules are lost (only if the simulation continues after the spindle breaks)
+        if total_length == 0:
+            return
+
         # Divided by two because now it does not distribute on the interface
         self.prob_rescue = [1. - exp(-self.par.total_rescue / total_length / 2. * self.par.dt)]
 
+    def logEvent(self, mt, event_type):
+        """
+        Write a line of the output (see Simulation::run)
+        :param mt:
+        :type mt: Microtubule
+        :param event_type:
+        :return:
+        """
+        self.sink.write('%u %.2f %.2f %i %i\n' % (mt.id, self.t, mt.pos, event_type, mt.orientation))
+
     def drawArrangement(self):
         """
         Draw a cartoon of the arrangement of microtubules, where the id microtubule is shown if the microtubule has not
@@ -236,7 +343,7 @@ class Simulation:
         ))
         if np.any(case1):
             # Pick a random one
-            picked_mt_id = np.random.choice(the_array[case1, 1])
+            picked_mt_id = self.rng.choice(the_array[case1, 1])
             self.swapMicrotubules(lost_mt_id,picked_mt_id)
             if self.par.print_linkers:
                 print("Swap case 1")
@@ -263,8 +370,8 @@ class Simulation:
         ))
 
         if np.any(case2):
-            neighbour_to_swap = np.random.choice(the_array[microtubules_to_pick_from, 1])
-            empty_slot_to_swap = np.random.choice(the_array[case2,1])
+            neighbour_to_swap = self.rng.choice(the_array[microtubules_to_pick_from, 1])
+            empty_slot_to_swap = self.rng.choice(the_array[case2,1])
             self.swapMicrotubules(neighbour_to_swap,empty_slot_to_swap)
             if self.par.print_linkers:
                 print("Swap case 2")
@@ -292,6 +399,14 @@ class Simulation:
         A function to check if the spindle disassembles (no contact between microtubules)
         :return:
         """
+        return not self.spindleOverlap() > 0
+
+    def spindleOverlap(self):
+        """
+        The length of the overlap between antiparallel microtubules: the lengths of the two longest microtubules of each
+        side minus the spindle length. The spindle is broken when this is not positive (see checkBrokenSpindle).
+        :return: the overlap, or -inf if there are no microtubules in one of the orientations
+        """
 
         # There must be microtubules oriented in both directions, and the lengths of the two longest microtubules of
         # each side have to be at least as long as the spindle
@@ -309,13 +424,12 @@ class Simulation:
             else:
                 lengths_minus1.append(mt_len)
 
-        if len(lengths_plus1) and len(lengths_minus1) and (
-                max(lengths_plus1) + max(lengths_minus1)) > self.half_spindle_length * 2:
-            return False
+        if len(lengths_plus1) and len(lengths_minus1):
+            return max(lengths_plus1) + max(lengths_minus1) - self.half_spindle_length * 2
         else:
-            return True
+            return -float('inf')
 
-    def run(self):
+    def run(self, stop_condition=None):
         """
         Run the simulation, the return value is a string containing the information to be printed to a text file. Each
         line has the following information as fields in a csv file:
@@ -329,32 +443,53 @@ class Simulation:
                  2: microtubule is lost
                  3: simulation end
             5) orientation of the microtubule
-        :return:
+
+        The simulation runs until par.max_time, or until stop_condition is met (by default, until the spindle breaks).
+        :param stop_condition: a function that takes the simulation as argument, and returns True to stop it. See
+        stopWhenBroken, stopWhenAllLost and stopWhenAny.
+        :return: the return value of sink.close(), by default the output as a string
         """
         self.t = 0
 
-        # We run 20 minutes of simulation time
-        while self.t < 20.:
-            self.t += self.par.dt
-            self.half_spindle_length += self.par.dt * self.par.v_slide
+        if stop_condition is None:
+            stop_condition = stopWhenBroken
 
-            if self.checkBrokenSpindle():
-                # The spindle is lost, stop the simulation
+        # By default we run 20 minutes of simulation time
+        while self.t < self.par.max_time:
+            if self.advance(stop_condition):
                 break
 
-            if self.par.ase1:
-                self.updateProbRescueAse1()
+        # Write the final timepoint
+        for mt in self.microtubules:
+            if not mt.lost:
+                self.logEvent(mt, 3)
 
-            for mt in self.microtubules:
-                if not mt.lost:
-                    mt.step()
+        return self.sink.close()
+
+    def advance(self, stop_condition):
+        """
+        Advance the simulation by one dt
+        :param stop_condition: see Simulation::run
+        :return: True if the stop condition is met, in which case microtubules do not move
+        """
+        self.t += self.par.dt
+        self.half_spindle_length += self.par.dt * self.par.v_slide
+
+        if stop_condition(self):
+            return True
+
+        if self.par.ase1:
+            self.updateProbRescueAse1()
 
-        # Write the final timepoint
         for mt in self.microtubules:
             if not mt.lost:
-                self.log += '%u %.2f %.2f 3 %i\n' % (mt.id, self.t, mt.pos, mt.orientation)
+                mt.step()
+
+        self.nb_steps += 1
+        if self.sample_stride is not None and self.nb_steps % self.sample_stride == 0:
+            self.recordSample()
 
-        return self.log
+        return False
 
 
 class Microtubule:
@@ -398,7 +533,7 @@ class Microtubule:
         self.lost = False
 
         # When the microtubule is created, we append it to the output of the simulation
-        self.sim.log += '%u %.2f %.2f -1 %i\n' % (self.id, self.sim.t, self.pos, self.orientation)
+        self.sim.logEvent(self, -1)
 
     def countNeighbours(self):
 
@@ -468,7 +603,7 @@ class Microtubule:
             if self.next_catastrophe < 0 or (self.pos*self.orientation) > self.sim.half_spindle_length:
                 self.growing = False
                 # We print the catastrophe event to the simulation output
-                self.sim.log += '%u %.2f %.2f 0 %i\n' % (self.id, self.sim.t, self.pos, self.orientation)
+                self.sim.logEvent(self, 0)
         else:
 
             # The microtubule shrinks
@@ -484,10 +619,10 @@ class Microtubule:
                 # Manage the consequences of losing the microtubule
                 self.sim.addLostMicrotubule(self.id)
                 # We print the loss event to the simulation output
-                self.sim.log += '%u %.2f %.2f 2 %i\n' % (self.id, self.sim.t, self.pos, self.orientation)
-            elif prob > random():
+                self.sim.logEvent(self, 2)
+            elif prob > self.sim.rng.random():
                 self.next_catastrophe = self.sim.timeToNextCatastrophe()
                 self.growing = True
                 # We print the rescue event to the simulation output
-                self.sim.log += '%u %.2f %.2f 1 %i\n' % (self.id, self.sim.t, self.pos, self.orientation)
+                self.sim.logEvent(self, 1)
 